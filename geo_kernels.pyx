@@ -0,0 +1,34 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+# Build with: python setup.py build_ext --inplace
+from libc.math cimport cos, M_PI, INFINITY
+from libc.stdint cimport uint8_t
+
+cdef double R = 6371000.0
+cdef double DEG_TO_RAD = M_PI / 180.0
+
+
+cpdef tuple find_closest_live_train(double user_lat, double user_lon,
+                                    const double[::1] lats, const double[::1] lons,
+                                    const uint8_t[::1] ghost):
+    # Nearest non-ghost train by squared equirectangular distance.
+    # Returns (index, squared metres), or (-1, inf) if every train is a ghost.
+    cdef Py_ssize_t i, n = lats.shape[0]
+    cdef Py_ssize_t best = -1
+    cdef double best_d2 = INFINITY
+    cdef double phi1 = user_lat * DEG_TO_RAD
+    cdef double cos_phi1 = cos(phi1)
+    cdef double lon1_rad = user_lon * DEG_TO_RAD
+    cdef double dx, dy, d2
+
+    with nogil:
+        for i in range(n):
+            if ghost[i]:
+                continue
+            dx = R * cos_phi1 * (lons[i] * DEG_TO_RAD - lon1_rad)
+            dy = R * (lats[i] * DEG_TO_RAD - phi1)
+            d2 = dx * dx + dy * dy
+            if d2 < best_d2:
+                best_d2 = d2
+                best = i
+
+    return best, best_d2
@@ -1,7 +1,12 @@
 from fastapi import FastAPI, HTTPException, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
-import requests
+from fastapi.responses import HTMLResponse, ORJSONResponse
+import httpx
+import asyncio
+from collections import defaultdict
+from cachetools import TTLCache
+import simdjson
+import numpy as np
 import math
 import os
 import io
@@ -10,7 +15,7 @@ from dotenv import load_dotenv
 from google.cloud import storage # <--- NEW LIBRARY
 
 # --- APP SETUP ---
-app = FastAPI() 
+app = FastAPI(default_response_class=ORJSONResponse)
 load_dotenv()
 
 # --- GCS CONFIGURATION ---
@@ -40,12 +45,35 @@ BASE_URL = "http://lapi.transitchicago.com/api/1.0/ttpositions.aspx"
 if not CTA_API_KEY:
     print("WARNING: CTA_API_KEY not found. Train tracking will fail.")
 
+# Shared async client so CTA calls reuse keep-alive connections and don't block the event loop
+cta_client = httpx.AsyncClient(
+    timeout=5.0,
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+)
+
+@app.on_event("shutdown")
+async def close_cta_client():
+    await cta_client.aclose()
+
+# Train positions per route, held for roughly one CTA update cycle
+TRAIN_CACHE_TTL = 10
+train_cache = TTLCache(maxsize=32, ttl=TRAIN_CACHE_TTL)
+train_cache_locks = defaultdict(asyncio.Lock)
+
+# One parser for the process so its tape and string buffers are reused across fetches.
+# fetch_trains only runs on the event loop thread, so it is never shared between threads
+CTA_PARSER = simdjson.Parser()
+
+# Load the frontend once at startup; it only changes on redeploy
+try:
+    with open("index.html", "rb") as f:
+        INDEX_HTML = f.read()
+except FileNotFoundError:
+    INDEX_HTML = b"Error: index.html not found."
+
 @app.get("/", response_class=HTMLResponse)
 def read_root():
-    if os.path.exists("index.html"):
-        with open("index.html", "r", encoding="utf-8") as f:
-            return f.read()
-    return "Error: index.html not found."
+    return HTMLResponse(content=INDEX_HTML)
 
 # --- NEW: GOOGLE CLOUD UPLOAD ENDPOINT ---
 @app.post("/submit-report")
@@ -78,59 +106,139 @@ async def submit_report(
         raise HTTPException(status_code=500, detail=f"Upload Failed: {e}")
 
 # --- EXISTING TRAIN LOGIC ---
-def calculate_distance(lat1, lon1, lat2, lon2):
-    R = 6371000
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi / 2)**2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2)**2
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
+def approx_distance_sq_m(phi1, cos_phi1, lat_rad, lon_rad_delta):
+    # Squared equirectangular distance: millimetre-accurate at the 200 m confidence range
+    # and well under 1% off across a whole line. Squared is enough for ranking, so the
+    # sqrt is only taken once for the winner
+    R = 6371000.0
+    dx = R * cos_phi1 * lon_rad_delta
+    dy = R * (lat_rad - phi1)
+    return dx * dx + dy * dy
+
+# Compiled kernel from geo_kernels.pyx (python setup.py build_ext --inplace)
+try:
+    from geo_kernels import find_closest_live_train
+except ImportError:
+    print("WARNING: geo_kernels extension not built. Using the pure-Python distance loop.")
+
+    def find_closest_live_train(user_lat, user_lon, lats, lons, ghost):
+        # Same contract as the Cython kernel: (index, squared metres), or (-1, inf)
+        phi1 = math.radians(user_lat)
+        cos_phi1 = math.cos(phi1)
+        lon1_rad = math.radians(user_lon)
+        best = -1
+        best_d2 = math.inf
+        for i, (t_lat, t_lon, is_ghost) in enumerate(zip(lats.tolist(), lons.tolist(), ghost.tolist())):
+            if is_ghost:
+                continue
+            d2 = approx_distance_sq_m(phi1, cos_phi1, math.radians(t_lat), math.radians(t_lon) - lon1_rad)
+            if d2 < best_d2:
+                best_d2 = d2
+                best = i
+        return best, best_d2
+
+# Confidence radius, kept squared to compare directly against approx_distance_sq_m
+HIGH_CONFIDENCE_RADIUS_M = 200
+HIGH_CONFIDENCE_RADIUS_SQ = HIGH_CONFIDENCE_RADIUS_M ** 2
+
+# CTA feed keys, looked up directly on the simdjson document. Only these six fields
+# per train are ever turned into Python objects; the rest of the payload stays on the tape
+RN, DEST_NM, NEXT_STA_NM, LAT, LON, IS_SCH = 'rn', 'destNm', 'nextStaNm', 'lat', 'lon', 'isSch'
+
+def build_train_columns(raw_trains):
+    # One scan over the CTA feed into parallel columns (struct-of-arrays)
+    run_numbers, destinations, next_stops, lats, lons, is_ghost = [], [], [], [], [], []
+    for t in raw_trains:
+        run_numbers.append(t[RN])
+        destinations.append(t[DEST_NM])
+        next_stops.append(t[NEXT_STA_NM])
+        lats.append(t[LAT])
+        lons.append(t[LON])
+        is_ghost.append(t.get(IS_SCH, '0') != '0')
+
+    # CTA sends lat/lon as strings; let NumPy convert them in one C-level pass
+    return {
+        "run_numbers": run_numbers,
+        "destinations": destinations,
+        "next_stops": next_stops,
+        "lats": np.asarray(lats, dtype=np.float64),
+        "lons": np.asarray(lons, dtype=np.float64),
+        "is_ghost": np.asarray(is_ghost, dtype=np.bool_),
+    }
+
+async def fetch_trains(route):
+    trains = train_cache.get(route)
+    if trains is not None:
+        return trains
+
+    # Per-route lock so concurrent misses share a single upstream fetch
+    async with train_cache_locks[route]:
+        trains = train_cache.get(route)
+        if trains is not None:
+            return trains
+
+        try:
+            response = await cta_client.get(BASE_URL, params={"key": CTA_API_KEY, "rt": route, "outputType": "JSON"})
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to connect to CTA: {str(e)}")
+
+        try:
+            # Lazy document: fields are pulled on access instead of building the whole tree.
+            # The proxies are only valid until CTA_PARSER parses again, so everything
+            # needed is copied out below with no await in between
+            data = CTA_PARSER.parse(response.content)
+        except ValueError as e:
+            raise HTTPException(status_code=500, detail=f"Failed to connect to CTA: {str(e)}")
+
+        if data.get('ctatt', {}).get('errNm'):
+            raise HTTPException(status_code=400, detail=f"CTA API Error: {data['ctatt']['errNm']}")
+
+        try:
+            raw_trains = data['ctatt']['route'][0]['train']
+        except (KeyError, IndexError):
+            raw_trains = []
+
+        trains = build_train_columns(raw_trains)
+        train_cache[route] = trains
+        return trains
 
 @app.get("/find-train/{route}")
-def find_user_train(route: str, lat: float, lon: float):
-    try:
-        response = requests.get(BASE_URL, params={"key": CTA_API_KEY, "rt": route, "outputType": "JSON"})
-        response.raise_for_status()
-        data = response.json()
-    except requests.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Failed to connect to CTA: {str(e)}")
-
-    if data.get('ctatt', {}).get('errNm'):
-        raise HTTPException(status_code=400, detail=f"CTA API Error: {data['ctatt']['errNm']}")
-
-    try:
-        raw_trains = data['ctatt']['route'][0]['train']
-    except (KeyError, IndexError):
+async def find_user_train(route: str, lat: float, lon: float):
+    trains = await fetch_trains(route)
+    if not trains["run_numbers"]:
         return {"found": False, "message": "No trains found on this line right now."}
 
-    live_trains = []
-    
-    for t in raw_trains:
-        # Ghost Filter
-        if t.get('isSch', '0') == '0':
-            t_lat = float(t['lat'])
-            t_lon = float(t['lon'])
-            dist_meters = calculate_distance(lat, lon, t_lat, t_lon)
-            
-            live_trains.append({
-                "run_number": t['rn'],
-                "destination": t['destNm'],
-                "next_stop": t['nextStaNm'],
-                "lat": t_lat,
-                "lon": t_lon,
-                "distance_meters": round(dist_meters, 1)
-            })
-
-    live_trains.sort(key=lambda x: x['distance_meters'])
-
-    if live_trains:
-        closest = live_trains[0]
-        return {
-            "found": True,
-            "closest_train": closest,
-            "confidence": "High" if closest['distance_meters'] < 200 else "Low",
-            "all_trains": live_trains 
+    # Ghost Filter + distance ranking in one pass; the bool column is viewed as uint8 for the kernel
+    best, best_d2 = find_closest_live_train(
+        lat, lon, trains["lats"], trains["lons"], trains["is_ghost"].view(np.uint8)
+    )
+    if best < 0:
+        return {"found": False, "message": "No live trains found."}
+
+    run_numbers = trains["run_numbers"]
+    destinations = trains["destinations"]
+    next_stops = trains["next_stops"]
+    lats = trains["lats"].tolist()
+    lons = trains["lons"].tolist()
+    ghosts = trains["is_ghost"].tolist()
+
+    all_trains = [
+        {
+            "run_number": run_numbers[i],
+            "destination": destinations[i],
+            "next_stop": next_stops[i],
+            "lat": lats[i],
+            "lon": lons[i],
+            "is_ghost": ghosts[i]
         }
-    
-    return {"found": False, "message": "No live trains found."}
+        for i in range(len(run_numbers))
+    ]
+    closest = dict(all_trains[best], distance_meters=round(math.sqrt(best_d2), 1))
+
+    return {
+        "found": True,
+        "closest_train": closest,
+        "confidence": "High" if best_d2 < HIGH_CONFIDENCE_RADIUS_SQ else "Low",
+        "all_trains": all_trains
+    }
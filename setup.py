@@ -0,0 +1,8 @@
+# Builds the geo_kernels extension: python setup.py build_ext --inplace
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name="transit-safe-geo-kernels",
+    ext_modules=cythonize("geo_kernels.pyx"),
+)